@@ -1,61 +1,152 @@
-from fastapi import APIRouter, UploadFile, File
-from models.documents import add_doc_with_link, get_document, search_documents, count_documents, delete_document, update_document
-from service.processors.service import delete_chunks, process_pdf, process_docx, process_text_file, add_document
+from fastapi import APIRouter, UploadFile, File, BackgroundTasks, Query, Response
+from fastapi.encoders import jsonable_encoder
+from models.documents import add_doc_with_link, get_document, search_documents, count_documents, delete_document, update_document, ensure_indexes, search_version, SEARCH_DEFAULT_SIZE, SEARCH_MAX_SIZE
+from service.processors.service import delete_chunks, add_document
+from service.processors.parsers import PARSERS, PARSE_MP_CONTEXT, parse_file
+from concurrent.futures import ProcessPoolExecutor
+from cachetools import TTLCache
+import asyncio
+import hashlib
+import logging
 import os
+import shutil
+import time
 import uuid
 import tempfile
 from datetime import datetime
-from typing import Optional, List
-from pydantic import BaseModel, validator
+from typing import Annotated, Literal, Optional, List
+from pydantic import AfterValidator, BaseModel, BeforeValidator, Field, WithJsonSchema, field_validator
 import httpx
+import aiofiles
+import orjson
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+UPLOAD_SPOOL_SIZE = 8 << 20
+DELETE_CHUNKS_RETRIES = 3
+DELETE_CHUNKS_RETRY_DELAY = 5
+
+DOCUMENT_CACHE_DIR = os.environ.get(
+    'DOCUMENT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'learnhub-documents'))
+DOCUMENT_CACHE_MAX_BYTES = int(
+    os.environ.get('DOCUMENT_CACHE_MAX_BYTES', str(1 << 30)))
+# Longer than the download timeout, so only files left by a dead worker match
+DOCUMENT_CACHE_PART_MAX_AGE = 3600
+
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL = 30
+
+_search_cache = TTLCache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+_PARSE_POOL = ProcessPoolExecutor(
+    max_workers=os.cpu_count(), mp_context=PARSE_MP_CONTEXT)
+
+# Each reprocess job holds a downloaded file and a parse result in memory
+REPROC_MAX_INFLIGHT = int(os.environ.get('REPROC_MAX_INFLIGHT', '4'))
+_REPROC_SEM = asyncio.Semaphore(REPROC_MAX_INFLIGHT)
+
+
+async def on_startup():
+  global _HTTP_CLIENT
+  os.makedirs(DOCUMENT_CACHE_DIR, exist_ok=True)
+  _HTTP_CLIENT = httpx.AsyncClient(
+      timeout=httpx.Timeout(300.0),
+      follow_redirects=True,
+      limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+      http2=True
+  )
+
+  try:
+    await ensure_indexes()
+  except Exception as e:
+    logger.warning('Creating document indexes failed: %s', e)
+
+
+async def on_shutdown():
+  global _HTTP_CLIENT
+  if _HTTP_CLIENT is not None:
+    await _HTTP_CLIENT.aclose()
+    _HTTP_CLIENT = None
+  _PARSE_POOL.shutdown(wait=False, cancel_futures=True)
+
+
+def _parse_ddmmyyyy(v):
+  if not isinstance(v, str):
+    raise ValueError('Date must be in dd/mm/yyyy format')
+  # Same inputs as strptime('%d/%m/%Y') without re-parsing the format each call
+  parts = v.split('/')
+  if len(parts) == 3:
+    day, month, year = parts
+    if 0 < len(day) <= 2 and 0 < len(month) <= 2 and len(year) == 4 \
+            and day.isdigit() and month.isdigit() and year.isdigit():
+      try:
+        return datetime(int(year), int(month), int(day))
+      except ValueError:
+        pass
+  raise ValueError('Date must be in dd/mm/yyyy format')
+
+
+def _end_of_day(v: datetime):
+  return v.replace(hour=23, minute=59, second=59)
+
+
+# Clients send dd/mm/yyyy strings; without this the schema says date-time
+_DDMMYYYY_SCHEMA = WithJsonSchema({
+    'type': 'string',
+    'pattern': r'^\d{1,2}/\d{1,2}/\d{4}$',
+    'examples': ['31/12/2024'],
+})
+
+StartDate = Annotated[datetime, BeforeValidator(
+    _parse_ddmmyyyy), _DDMMYYYY_SCHEMA]
+EndDate = Annotated[datetime, BeforeValidator(
+    _parse_ddmmyyyy), AfterValidator(_end_of_day), _DDMMYYYY_SCHEMA]
 
 
 class SearchQuery(BaseModel):
   user_id: Optional[str] = None
   is_public: Optional[bool] = None
-  min_date: Optional[str] = None
-  max_date: Optional[str] = None
+  min_date: Optional[StartDate] = None
+  max_date: Optional[EndDate] = None
   filename: Optional[str] = None
   file_extension: Optional[str] = None
-  size: Optional[int] = None
-  start: Optional[int] = None
+  size: Optional[int] = Field(SEARCH_DEFAULT_SIZE, ge=1, le=SEARCH_MAX_SIZE)
+  start: Optional[int] = Field(None, ge=0)
   sort_by: Optional[str] = None
   sort_order: Optional[int] = None
 
-  @validator('min_date', 'max_date')
-  def parse_date(cls, v):
-    if v is None:
-      return None
-    try:
-      date_obj = datetime.strptime(v, '%d/%m/%Y')
-      return date_obj
-    except ValueError:
-      raise ValueError('Date must be in dd/mm/yyyy format')
-
-  # @validator('sort_by')
+  # @field_validator('sort_by')
+  # @classmethod
   # def validate_sort_by(cls, v):
   #   if v is not None and v not in ["date"]:
   #     raise ValueError("sort_by must be 'date'")
   #   return v
 
-  @validator('sort_order')
+  @field_validator('sort_order')
+  @classmethod
   def validate_sort_order(cls, v):
     if v is not None and v not in [-1, 1]:
       raise ValueError(
           "sort_order must be either -1 (descending) or 1 (ascending)")
     return v
 
-  def model_post_init(self, __context):
-    if self.max_date:
-      self.max_date = self.max_date.replace(hour=23, minute=59, second=59)
-
 
 @router.post("/document/search")
 async def search_documents_route(query: SearchQuery):
   try:
-    results = await search_documents(
+    digest = hashlib.md5(
+        query.model_dump_json(exclude_none=True).encode()).hexdigest()
+    cache_key = f'search:{search_version(query.user_id)}:{digest}'
+
+    cached = _search_cache.get(cache_key)
+    if cached is not None:
+      return Response(content=cached, media_type='application/json')
+
+    results, total = await search_documents(
         user_id=query.user_id,
         is_public=query.is_public,
         min_date=query.min_date,
@@ -68,12 +159,15 @@ async def search_documents_route(query: SearchQuery):
         sort_order=query.sort_order
     )
 
-    return {
+    content = orjson.dumps(jsonable_encoder({
         "status": "success",
         "data": results,
-        "total": len(results),
+        "total": total,
         "message": "Documents fetched successfully"
-    }
+    }))
+    _search_cache[cache_key] = content
+
+    return Response(content=content, media_type='application/json')
   except Exception as e:
     return {
         "status": "error",
@@ -132,11 +226,28 @@ async def get_document_route(document_id: str):
     }
 
 
+async def retry_delete_chunks(document_id: str):
+  for attempt in range(DELETE_CHUNKS_RETRIES):
+    await asyncio.sleep(DELETE_CHUNKS_RETRY_DELAY * (attempt + 1))
+    try:
+      await delete_chunks(document_id)
+      return
+    except Exception as e:
+      logger.warning('Retry %d deleting chunks of %s failed: %s',
+                     attempt + 1, document_id, e)
+
+
 @router.delete("/document/{document_id}")
-async def delete_document_route(document_id: str):
+async def delete_document_route(document_id: str, background_tasks: BackgroundTasks):
   try:
-    await delete_chunks(document_id)
-    success = await delete_document(document_id)
+    chunks_result, success = await asyncio.gather(
+        delete_chunks(document_id),
+        delete_document(document_id),
+        return_exceptions=True
+    )
+
+    if isinstance(success, Exception):
+      raise success
 
     if not success:
       return {
@@ -144,6 +255,18 @@ async def delete_document_route(document_id: str):
           "message": "Document not found"
       }
 
+    if isinstance(chunks_result, Exception):
+      # The Mongo record is gone; retry the Pinecone cleanup instead of failing
+      logger.warning('Deleting chunks of %s failed: %s',
+                     document_id, chunks_result)
+      background_tasks.add_task(retry_delete_chunks, document_id)
+
+    # The user asked for the file to be deleted, so don't keep a cached copy
+    try:
+      await asyncio.to_thread(_remove_cached_document, document_id)
+    except OSError as e:
+      logger.warning('Removing cached file of %s failed: %s', document_id, e)
+
     return {
         "status": "success",
         "message": "Document and its chunks deleted successfully"
@@ -155,62 +278,155 @@ async def delete_document_route(document_id: str):
     }
 
 
-async def download_document_file(document_id: str):
-  document = await get_document(document_id)
-  if not document:
-    return None, "Document not found"
+def _safe_unlink(path: str):
+  try:
+    os.unlink(path)
+  except FileNotFoundError:
+    pass
+
+
+def _document_cache_paths(document: dict):
+  file_path = os.path.join(
+      DOCUMENT_CACHE_DIR, f"{document['_id']}.{document['file_extension']}")
+  return file_path, file_path + '.etag'
+
+
+def _read_etag(etag_path: str):
+  try:
+    with open(etag_path) as f:
+      return f.read().strip() or None
+  except FileNotFoundError:
+    return None
+
+
+def _write_etag(etag_path: str, etag: Optional[str]):
+  if etag:
+    with open(etag_path, 'w') as f:
+      f.write(etag)
+  else:
+    _safe_unlink(etag_path)
+
+
+def _scan_document_cache():
+  # The default cache dir lives under /tmp, where a cleaner may remove it
+  try:
+    return list(os.scandir(DOCUMENT_CACHE_DIR))
+  except FileNotFoundError:
+    return []
+
+
+def _remove_cached_document(document_id: str):
+  prefix = f'{document_id}.'
+  for entry in _scan_document_cache():
+    if entry.name.startswith(prefix):
+      _safe_unlink(entry.path)
+
+
+def _evict_document_cache(keep: Optional[str] = None):
+  # Drop the least recently used files until the cache fits its size cap
+  entries = []
+  total = 0
+  stale_before = time.time() - DOCUMENT_CACHE_PART_MAX_AGE
+  for entry in _scan_document_cache():
+    if not entry.is_file() or entry.name.endswith('.etag'):
+      continue
+    try:
+      stat = entry.stat()
+    except FileNotFoundError:
+      # Replaced or evicted by a concurrent request since the scan listed it
+      continue
+    if entry.name.endswith('.part'):
+      # Partial downloads still in flight count toward the cap; abandoned ones go
+      if stat.st_mtime < stale_before:
+        _safe_unlink(entry.path)
+      else:
+        total += stat.st_size
+      continue
+    total += stat.st_size
+    if entry.path != keep:
+      entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+  for _, size, path in sorted(entries):
+    if total <= DOCUMENT_CACHE_MAX_BYTES:
+      break
+    _safe_unlink(path)
+    _safe_unlink(path + '.etag')
+    total -= size
+
+
+async def download_document_file(document: dict):
+  file_path, etag_path = _document_cache_paths(document)
 
   headers = {
       "User-Agent": "Mozilla/5.0 (Windows NT 6.1; Win64; x64; rv:47.0) Gecko/20100101 Firefox/47.0"
   }
 
-  async with httpx.AsyncClient(
-      timeout=httpx.Timeout(300.0),
-      follow_redirects=True
-  ) as client:
-    print(f'Downloading file from url={document["file_url"]}')
-    print(headers)
+  etag = None
+  if os.path.exists(file_path):
+    etag = await asyncio.to_thread(_read_etag, etag_path)
+  if etag:
+    headers['If-None-Match'] = etag
+
+  logger.debug('Downloading file from url=%s', document['file_url'])
+  logger.debug('Request headers: %s', headers)
+
+  async with _HTTP_CLIENT.stream('GET', document['file_url'], headers=headers) as response:
+    if response.status_code == 304 and etag:
+      os.utime(file_path)
+      logger.debug('File not modified, using cached copy')
+      return file_path, document['file_extension']
 
-    async with client.stream('GET', document['file_url'], headers=headers) as response:
-      if response.status_code != 200:
-        return None, "Failed to download file from URL"
+    if response.status_code != 200:
+      return None, "Failed to download file from URL"
 
-      file_ext = document['file_extension']
-      with tempfile.NamedTemporaryFile(delete=False, suffix='.'+file_ext) as tmp:
-        temp_file_path = tmp.name
-        async for chunk in response.aiter_bytes():
-          tmp.write(chunk)
-        tmp.flush()
+    os.makedirs(DOCUMENT_CACHE_DIR, exist_ok=True)
+    fd, temp_file_path = tempfile.mkstemp(suffix='.part', dir=DOCUMENT_CACHE_DIR)
+    os.close(fd)
+    try:
+      async with aiofiles.open(temp_file_path, 'wb') as f:
+        async for chunk in response.aiter_bytes(chunk_size=UPLOAD_CHUNK_SIZE):
+          await f.write(chunk)
+    except Exception:
+      _safe_unlink(temp_file_path)
+      raise
+
+  os.replace(temp_file_path, file_path)
+  await asyncio.to_thread(_write_etag, etag_path, response.headers.get('etag'))
 
-  print('Download successfully')
-  return temp_file_path, document['file_extension']
+  logger.debug('Download successfully')
+  return file_path, document['file_extension']
 
 
 @router.post("/document/pinecone/{document_id}")
-async def reprocess_to_pinecone(document_id: str):
+async def reprocess_to_pinecone(document_id: str, background_tasks: BackgroundTasks):
   try:
-    temp_file_path, file_ext = await download_document_file(document_id)
-    if not temp_file_path:
-      return {
-          "status": "error",
-          "message": file_ext
-      }
+    async with _REPROC_SEM:
+      document = await get_document(document_id, use_cache=False)
+      if not document:
+        return {
+            "status": "error",
+            "message": "Document not found"
+        }
 
-    print('Processing file')
+      if document['file_extension'] not in PARSERS:
+        raise ValueError(f"Unsupported file type: {document['file_extension']}")
 
-    try:
-      if file_ext == 'pdf':
-        documents = await process_pdf(temp_file_path)
-      elif file_ext in ['docx', 'doc']:
-        documents = await process_docx(temp_file_path)
-      elif file_ext in ['md', 'txt']:
-        documents = await process_text_file(temp_file_path)
-      else:
-        raise ValueError(f"Unsupported file type: {file_ext}")
+      file_path, file_ext = await download_document_file(document)
+      if not file_path:
+        return {
+            "status": "error",
+            "message": file_ext
+        }
+
+      background_tasks.add_task(_evict_document_cache, file_path)
 
-      print('Processing successfully')
+      logger.debug('Processing file')
+
+      documents = await asyncio.get_running_loop().run_in_executor(
+          _PARSE_POOL, parse_file, file_path, file_ext)
+
+      logger.debug('Processing successfully')
 
-      document = await get_document(document_id)
       await add_document(
           documents,
           document['user_id'],
@@ -219,17 +435,13 @@ async def reprocess_to_pinecone(document_id: str):
           document['filename']
       )
 
-      print('Adding to Pinecone')
+      logger.debug('Adding to Pinecone')
 
       return {
           "status": "success",
           "message": f"Successfully reprocessed {len(documents)} documents into Pinecone"
       }
 
-    finally:
-      if os.path.exists(temp_file_path):
-        os.remove(temp_file_path)
-
   except Exception as e:
     return {
         "status": "error",
@@ -247,21 +459,17 @@ async def upload_document(
     filename = file.filename
     file_ext = os.path.splitext(filename)[1].lower()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
-      temp_file_path = tmp.name
-      content = await file.read()
-      tmp.write(content)
-
-    result = await add_doc_with_link(
-        user_id=user_id,
-        is_public=is_public,
-        filename=file.filename,
-        file_path=temp_file_path,
-    )
-
-    os.remove(temp_file_path)
+    # Small uploads stay in memory; larger ones roll over to disk
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, suffix=file_ext) as tmp:
+      await file.seek(0)
+      await asyncio.to_thread(shutil.copyfileobj, file.file, tmp, UPLOAD_CHUNK_SIZE)
 
-    document = await get_document(str(result.inserted_id))
+      document = await add_doc_with_link(
+          user_id=user_id,
+          is_public=is_public,
+          filename=file.filename,
+          file=tmp,
+      )
 
     return {
         "status": "success",
@@ -270,47 +478,50 @@ async def upload_document(
     }
 
   except Exception as e:
-    if os.path.exists(temp_file_path):
-      os.remove(temp_file_path)
-
     return {
         "status": "error",
         "message": str(e)
     }
 
 
+# Documents store their creation time as 'date'
+_LIST_SORT_FIELDS = {
+    "created_date": "date",
+    "questions_count": "questions_count",
+}
+
+
 @router.get("/documents")
 async def list_documents(
     user_id: str,
-    page: int = 1,
-    limit: int = 10,
-    sort_by: str = "created_date",
-    sort_order: int = -1
+    page: int = Query(1, ge=1),
+    limit: int = Query(10, ge=1, le=SEARCH_MAX_SIZE),
+    sort_by: Literal["created_date", "questions_count"] = "created_date",
+    sort_order: Annotated[Literal[-1, 1], BeforeValidator(int)] = -1
 ):
   try:
-    if sort_by not in ["created_date", "questions_count"]:
-      raise ValueError(
-          "sort_by must be either 'created_date' or 'questions_count'")
-    if sort_order not in [-1, 1]:
-      raise ValueError(
-          "sort_order must be either -1 (descending) or 1 (ascending)")
-
-    documents = await list_user_documents(
+    documents, total = await search_documents(
         user_id=user_id,
-        page=page,
-        limit=limit,
-        sort_by=sort_by,
+        start=(page - 1) * limit,
+        size=limit,
+        sort_by=_LIST_SORT_FIELDS[sort_by],
         sort_order=sort_order
     )
     return {
         "status": "success",
         "data": documents,
+        "total": total,
+        "page": page,
+        "limit": limit,
         "message": "Documents fetched successfully"
     }
   except Exception as e:
     return {
         "status": "error",
         "data": [],
+        "total": 0,
+        "page": page,
+        "limit": limit,
         "message": str(e)
     }
 
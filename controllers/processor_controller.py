@@ -102,8 +102,8 @@ async def process_file(temp_file_path, user_id, is_public, file_ext, task_id, mo
 
       task_results[task_id] = {"status": "uploading"}
 
-      insert_result = await add_doc_with_link(user_id, is_public, filename, temp_file_path)
-      document_id = str(insert_result.inserted_id)
+      document_info = await add_doc_with_link(user_id, is_public, filename, temp_file_path)
+      document_id = document_info['_id']
 
       print(f'Insert {document_id} into MongoDB')
 
@@ -1,11 +1,21 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from controllers import health_controller, generator_controller, processor_controller, shared_resources
+from fastapi.middleware.gzip import GZipMiddleware
+from controllers import health_controller, generator_controller, processor_controller, shared_resources, document_controller
 from controllers.quizzes_controller import router as quizzes_router
 from controllers.document_controller import router as upload_router
 from controllers.results_controller import router as results_router
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  await document_controller.on_startup()
+  yield
+  await document_controller.on_shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -14,6 +24,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 app.include_router(health_controller.router)
 app.include_router(generator_controller.router)
@@ -1,13 +1,54 @@
 from models.mongo import mongo_database
 from datetime import datetime, timezone
 from bson import ObjectId
-from typing import Optional
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import BinaryIO, Optional
+from cachetools import TTLCache
+import asyncio
 import os
-from service.generators.base import upload_file
+from service.generators.base import upload_file, upload_fileobj
 
 
 collection = mongo_database['documents']
 
+DOCUMENT_CACHE_SIZE = 4096
+DOCUMENT_CACHE_TTL = 60
+
+# The $facet page is returned inside one result document, which is bound by
+# MongoDB's 16 MB BSON limit, so search pages are always capped
+SEARCH_DEFAULT_SIZE = 100
+SEARCH_MAX_SIZE = 1000
+
+_document_cache = TTLCache(maxsize=DOCUMENT_CACHE_SIZE, ttl=DOCUMENT_CACHE_TTL)
+_document_locks: dict[str, asyncio.Lock] = {}
+# Bumped by invalidate_document; a lookup that started before an
+# invalidation must not write its (possibly stale) result into the cache
+_document_cache_epoch = 0
+
+# Per-user counters bumped on every write, so cached search results keyed
+# on them go stale immediately; PUBLIC_SEARCH_SCOPE covers public searches
+PUBLIC_SEARCH_SCOPE = '*'
+_search_versions: dict[str, int] = {}
+
+
+def search_version(user_id: Optional[str]) -> int:
+  return _search_versions.get(user_id or PUBLIC_SEARCH_SCOPE, 0)
+
+
+def bump_search_version(user_id: Optional[str]):
+  for scope in {user_id or PUBLIC_SEARCH_SCOPE, PUBLIC_SEARCH_SCOPE}:
+    _search_versions[scope] = _search_versions.get(scope, 0) + 1
+
+
+async def ensure_indexes():
+  # Matches the filters built by build_search_query; safe to run repeatedly
+  await collection.create_indexes([
+      IndexModel([('user_id', ASCENDING), ('date', DESCENDING)]),
+      IndexModel([('user_id', ASCENDING), ('is_public', ASCENDING),
+                  ('date', DESCENDING)]),
+      IndexModel([('is_public', ASCENDING), ('date', DESCENDING)]),
+  ])
+
 
 async def add_document(user_id: str, is_public: bool, filename: str, file_url: str, file_size: int, file_extension: str):
   document = {
@@ -19,13 +60,27 @@ async def add_document(user_id: str, is_public: bool, filename: str, file_url: s
       'file_extension': file_extension,
       'date': datetime.now(timezone.utc),
   }
-  return await collection.insert_one(document)
+  await collection.insert_one(document)
+
+  # Match what find_one returns: naive UTC with millisecond precision
+  date = document['date']
+  document['date'] = date.replace(
+      tzinfo=None, microsecond=date.microsecond // 1000 * 1000)
+  document['_id'] = str(document['_id'])
+  _document_cache[document['_id']] = document
+  bump_search_version(user_id)
+  return document
 
 
-async def add_doc_with_link(user_id: str, is_public: bool, filename: str, file_path: str):
-  file_url = await upload_file(file_path)
-  file_size = os.path.getsize(file_path)  # size in bytes
-  file_extension = os.path.splitext(file_path)[1]
+async def add_doc_with_link(user_id: str, is_public: bool, filename: str, file_path: Optional[str] = None, file: Optional[BinaryIO] = None):
+  if file is not None:
+    file_extension = os.path.splitext(filename)[1].lower()
+    file_url = await upload_fileobj(file, file_extension)
+    file_size = file.seek(0, os.SEEK_END)  # size in bytes
+  else:
+    file_url = await upload_file(file_path)
+    file_size = os.path.getsize(file_path)  # size in bytes
+    file_extension = os.path.splitext(file_path)[1]
 
   filename = filename.replace(file_extension, '')
   file_extension = file_extension.replace('.', '')
@@ -40,37 +95,76 @@ async def add_doc_with_link(user_id: str, is_public: bool, filename: str, file_p
   )
 
 
-async def get_document(document_id: str):
+async def _fetch_document(document_id: str):
+  epoch = _document_cache_epoch
   object_id = ObjectId(document_id)
   document = await collection.find_one({'_id': object_id})
 
   if document and '_id' in document:
     document['_id'] = str(document['_id'])
 
+  if not document:
+    _document_cache.pop(document_id, None)
+  elif epoch == _document_cache_epoch:
+    _document_cache[document_id] = document
+
   return document
 
 
+async def get_document(document_id: str, use_cache: bool = True):
+  # Write paths pass use_cache=False: a cached copy may be up to
+  # DOCUMENT_CACHE_TTL old or outlive a delete made on another worker
+  if not use_cache:
+    return await _fetch_document(document_id)
+
+  document = _document_cache.get(document_id)
+  if document is not None:
+    return document
+
+  # Concurrent misses for the same id wait on one Mongo lookup
+  lock = _document_locks.setdefault(document_id, asyncio.Lock())
+  try:
+    async with lock:
+      document = _document_cache.get(document_id)
+      if document is not None:
+        return document
+
+      return await _fetch_document(document_id)
+  finally:
+    if _document_locks.get(document_id) is lock:
+      del _document_locks[document_id]
+
+
+def invalidate_document(document_id: str):
+  global _document_cache_epoch
+  _document_cache_epoch += 1
+  _document_cache.pop(document_id, None)
+
+
 async def delete_document(document_id: str):
   try:
     object_id = ObjectId(document_id)
-    result = await collection.delete_one({'_id': object_id})
-    return result.deleted_count > 0
+    document = await collection.find_one_and_delete(
+        {'_id': object_id}, projection={'user_id': 1})
+    invalidate_document(document_id)
+
+    if document is None:
+      return False
+
+    bump_search_version(document.get('user_id'))
+    return True
   except Exception as e:
     raise Exception(f"Error deleting document: {str(e)}")
 
 
-async def search_documents(
+def build_search_query(
     user_id: Optional[str] = None,
     is_public: Optional[bool] = None,
     min_date: Optional[datetime] = None,
     max_date: Optional[datetime] = None,
     filename: Optional[str] = None,
-    file_extension: Optional[str] = None,
-    size: Optional[int] = None,
-    start: Optional[int] = None,
-    sort_by: Optional[str] = None,
-    sort_order: Optional[int] = None
-):
+    file_extension: Optional[str] = None
+) -> dict:
   query = {}
 
   if user_id is None:
@@ -95,24 +189,49 @@ async def search_documents(
     query['file_extension'] = {
         '$regex': f'^{file_extension}$', '$options': 'i'}
 
-  cursor = collection.find(query)
+  return query
+
+
+async def search_documents(
+    user_id: Optional[str] = None,
+    is_public: Optional[bool] = None,
+    min_date: Optional[datetime] = None,
+    max_date: Optional[datetime] = None,
+    filename: Optional[str] = None,
+    file_extension: Optional[str] = None,
+    size: Optional[int] = None,
+    start: Optional[int] = None,
+    sort_by: Optional[str] = None,
+    sort_order: Optional[int] = None
+):
+  query = build_search_query(
+      user_id, is_public, min_date, max_date, filename, file_extension)
+
+  pipeline = [{'$match': query}]
 
   if sort_by is not None and sort_order is not None:
-    sort_dict = {sort_by: sort_order}
-    cursor = cursor.sort(sort_dict)
+    pipeline.append({'$sort': {sort_by: sort_order}})
+
+  # One round trip for both the requested page and the total match count
+  page = [
+      {'$skip': max(start or 0, 0)},
+      {'$limit': min(size or SEARCH_MAX_SIZE, SEARCH_MAX_SIZE)}
+  ]
 
-  if start is not None:
-    cursor = cursor.skip(start)
-  if size is not None:
-    cursor = cursor.limit(size)
+  pipeline.append({'$facet': {
+      'data': page,
+      'total': [{'$count': 'n'}]
+  }})
 
-  results = await cursor.to_list(length=size)
+  facets = await collection.aggregate(pipeline).to_list(length=1)
+  results = facets[0]['data'] if facets else []
+  total = facets[0]['total'][0]['n'] if facets and facets[0]['total'] else 0
 
   for doc in results:
     if '_id' in doc:
       doc['_id'] = str(doc['_id'])
 
-  return results
+  return results, total
 
 
 async def count_documents(
@@ -123,28 +242,8 @@ async def count_documents(
     filename: Optional[str] = None,
     file_extension: Optional[str] = None
 ) -> int:
-  query = {}
-
-  if user_id is None:
-    query['is_public'] = True
-  else:
-    query['user_id'] = user_id
-    if is_public is not None:
-      query['is_public'] = is_public
-
-  if min_date or max_date:
-    query['date'] = {}
-    if min_date:
-      query['date']['$gte'] = min_date
-    if max_date:
-      query['date']['$lte'] = max_date
-
-  if filename:
-    query['filename'] = {'$regex': filename, '$options': 'i'}
-
-  if file_extension:
-    query['file_extension'] = {
-        '$regex': f'^{file_extension}$', '$options': 'i'}
+  query = build_search_query(
+      user_id, is_public, min_date, max_date, filename, file_extension)
 
   count = await collection.count_documents(query)
   return count
@@ -168,10 +267,14 @@ async def update_document(document_id: str, filename: Optional[str] = None, is_p
       {'$set': update_data}
     )
     
+    invalidate_document(document_id)
+
     if result.modified_count == 0:
       return None
       
-    updated_document = await get_document(document_id)
+    updated_document = await get_document(document_id, use_cache=False)
+    if updated_document:
+      bump_search_version(updated_document.get('user_id'))
     return updated_document
   except Exception as e:
     raise Exception(f"Error updating document: {str(e)}")
@@ -6,6 +6,7 @@ from google.genai import types
 import asyncio
 import pathlib
 import os
+import shutil
 import tempfile
 
 
@@ -55,14 +56,20 @@ def fix_json_array(jsons):
 
 
 async def upload_file(file_path: str):
+  file_ext = os.path.splitext(file_path)[1].lower()
+  with open(file_path, 'rb') as file:
+    return await upload_fileobj(file, file_ext)
+
+
+async def upload_fileobj(file, file_ext: str):
   try:
-    file_ext = os.path.splitext(file_path)[1].lower()
+    file_ext = file_ext.lower()
     temp_path = None
 
     with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp:
       temp_path = tmp.name
-      content = await asyncio.to_thread(lambda: open(file_path, 'rb').read())
-      tmp.write(content)
+      file.seek(0)
+      await asyncio.to_thread(shutil.copyfileobj, file, tmp)
 
     if file_ext == '.doc':
       new_path = temp_path.replace('.doc', '.ahihi1')
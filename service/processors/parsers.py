@@ -0,0 +1,146 @@
+# Parsing only: no API clients or vector store setup, so worker processes
+# can import this module without the side effects of service.py
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core import SimpleDirectoryReader, Document
+from llama_index.readers.file import PDFReader, DocxReader, MarkdownReader
+from pypdf import PdfReader
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import json
+import multiprocessing
+import os
+
+PDF_PARSE_RULES_PATH = os.environ.get(
+    'PDF_PARSE_RULES_PATH', os.path.join(os.path.dirname(__file__), 'pdf_parse_rules.json'))
+
+# Process pools start workers from a clean forkserver rather than forking
+# the running server, whose Motor/asyncio/Pinecone threads may hold locks
+PARSE_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+PARSE_MP_CONTEXT.set_forkserver_preload([__name__])
+
+# Set by parse_file, which only runs inside parse pool workers
+_in_parse_worker = False
+
+node_parser = SentenceSplitter(
+    chunk_size=1024,
+    chunk_overlap=20,
+    paragraph_separator="\n\n",
+    secondary_chunking_regex="[^,.;。]+[,.;。]?",
+)
+
+
+def load_pdf_parse_rules(path: str = PDF_PARSE_RULES_PATH) -> list[dict]:
+  with open(path) as f:
+    return json.load(f)['rules']
+
+
+pdf_parse_rules = load_pdf_parse_rules()
+
+
+def select_pdf_parse_rule(page_count: int) -> dict:
+  for rule in pdf_parse_rules:
+    if rule.get('max_pages') is None or page_count <= rule['max_pages']:
+      return rule
+  return {'method': 'sequential'}
+
+
+def count_pdf_pages(file_path: str) -> int:
+  return len(PdfReader(file_path).pages)
+
+
+def load_pdf_pages(file_path: str, start: int, stop: int) -> list[Document]:
+  # Same per-page documents and metadata as PDFReader, for a page range
+  pdf = PdfReader(file_path)
+  file_name = os.path.basename(file_path)
+  return [
+      Document(
+          text=pdf.pages[page].extract_text(),
+          metadata={"page_label": pdf.page_labels[page], "file_name": file_name}
+      )
+      for page in range(start, stop)
+  ]
+
+
+async def load_pdf_text(file_path: str) -> list[Document]:
+  page_count = await asyncio.to_thread(count_pdf_pages, file_path)
+  rule = select_pdf_parse_rule(page_count)
+  method = rule['method']
+
+  if method == 'sequential':
+    return await asyncio.to_thread(PDFReader().load_data, file_path)
+
+  # Parse pool workers must not spawn another pool
+  if method == 'process' and _in_parse_worker:
+    method = 'thread'
+
+  batch_size = rule['batch_size']
+  ranges = [(start, min(start + batch_size, page_count))
+            for start in range(0, page_count, batch_size)]
+  max_workers = min(len(ranges), os.cpu_count() or 1)
+  if method == 'process':
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=PARSE_MP_CONTEXT)
+  else:
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+
+  loop = asyncio.get_running_loop()
+  with executor:
+    batches = await asyncio.gather(*[
+        loop.run_in_executor(executor, load_pdf_pages, file_path, start, stop)
+        for start, stop in ranges
+    ])
+
+  return [doc for batch in batches for doc in batch]
+
+
+def chunk_documents(documents: list[Document]) -> list[Document]:
+  nodes = node_parser.get_nodes_from_documents(documents)
+
+  chunked_documents = []
+  for node in nodes:
+    doc = Document(
+        text=node.text,
+        metadata=node.metadata
+    )
+    chunked_documents.append(doc)
+
+  return chunked_documents
+
+
+async def process_pdf_text(file_path: str) -> list[Document]:
+  return chunk_documents(await load_pdf_text(file_path))
+
+
+async def process_docx(file_path: str) -> list[Document]:
+  reader = DocxReader()
+  documents = reader.load_data(file_path)
+  return chunk_documents(documents)
+
+
+async def process_text_file(file_path: str) -> list[Document]:
+  documents = []
+
+  if file_path.endswith('.md'):
+    reader = MarkdownReader()
+    documents = reader.load_data(file_path)
+  else:
+    reader = SimpleDirectoryReader(input_files=[file_path])
+    documents = reader.load_data()[0]
+
+  return chunk_documents(documents)
+
+
+PARSERS = {
+    'pdf': process_pdf_text,
+    'docx': process_docx,
+    'doc': process_docx,
+    'md': process_text_file,
+    'txt': process_text_file,
+}
+
+
+def parse_file(file_path: str, file_ext: str) -> list[Document]:
+  # Entry point for worker processes, so parsing never blocks the event loop
+  global _in_parse_worker
+  _in_parse_worker = True
+  return asyncio.run(PARSERS[file_ext](file_path))
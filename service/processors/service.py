@@ -1,6 +1,6 @@
 from llama_index.core.node_parser import SentenceSplitter
 from llama_index.core.ingestion import IngestionPipeline, IngestionCache
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex, Document
+from llama_index.core import VectorStoreIndex, Document
 from llama_index.core.vector_stores import FilterCondition, FilterOperator, MetadataFilter, MetadataFilters
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
@@ -10,9 +10,9 @@ from llama_index.vector_stores.pinecone import PineconeVectorStore
 from llama_index.llms.google_genai import GoogleGenAI
 from llama_index.core.response_synthesizers import get_response_synthesizer
 from llama_index.core.prompts import PromptTemplate
-from llama_index.readers.file import PDFReader, DocxReader, MarkdownReader
 from service.generators.base import GenAIClient
 from service.generators.doc_processor.pdf import PDFProcessor
+from service.processors.parsers import node_parser, load_pdf_text, process_docx, process_text_file
 from pinecone import Pinecone
 import asyncio
 import google.generativeai as genai
@@ -62,13 +62,6 @@ index = VectorStoreIndex.from_vector_store(vector_store=vector_store)
 retriever = VectorIndexRetriever(index=index, similarity_top_k=5)
 query_engine = RetrieverQueryEngine(retriever=retriever)
 
-node_parser = SentenceSplitter(
-    chunk_size=1024,
-    chunk_overlap=20,
-    paragraph_separator="\n\n",
-    secondary_chunking_regex="[^,.;。]+[,.;。]?",
-)
-
 
 async def delete_chunks(document_id: str):
   try:
@@ -142,8 +135,7 @@ async def process_pdf_images(pdf_path: str, chunk_size: int = 10, chunk_overlap:
 
 async def process_pdf(file_path: str, mode: str = "text") -> list[Document]:
   if mode == "text":
-    reader = PDFReader()
-    documents = reader.load_data(file_path)
+    documents = await load_pdf_text(file_path)
   else:
     documents = await process_pdf_images(file_path)
 
@@ -161,46 +153,6 @@ async def process_pdf(file_path: str, mode: str = "text") -> list[Document]:
   return chunked_documents
 
 
-async def process_docx(file_path: str) -> list[Document]:
-  reader = DocxReader()
-  documents = reader.load_data(file_path)
-
-  nodes = node_parser.get_nodes_from_documents(documents)
-
-  chunked_documents = []
-  for node in nodes:
-    doc = Document(
-        text=node.text,
-        metadata=node.metadata
-    )
-    chunked_documents.append(doc)
-
-  return chunked_documents
-
-
-async def process_text_file(file_path: str) -> list[Document]:
-  documents = []
-
-  if file_path.endswith('.md'):
-    reader = MarkdownReader()
-    documents = reader.load_data(file_path)
-  else:
-    reader = SimpleDirectoryReader(input_files=[file_path])
-    documents = reader.load_data()[0]
-
-  nodes = node_parser.get_nodes_from_documents(documents)
-
-  chunked_documents = []
-  for node in nodes:
-    doc = Document(
-        text=node.text,
-        metadata=node.metadata
-    )
-    chunked_documents.append(doc)
-
-  return chunked_documents
-
-
 async def add_document(doc, user_id, is_public=False, document_id=None, filename=None):
   for d in doc:
     d.metadata.update({